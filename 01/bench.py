@@ -0,0 +1,134 @@
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from itertools import combinations
+
+import task
+
+# The current DFS copies the route at every step and explores paths, not
+# cells, so on large mazes it runs in a child process that is killed after
+# DFS_TIMEOUT seconds.
+DFS_TIMEOUT = 60
+EXHAUSTIVE_MAX_SIZE = 5000
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def timed_in_child(timeout, f, *args):
+    with multiprocessing.Pool(1) as pool:
+        result = pool.apply_async(timed, (f, *args))
+        try:
+            return result.get(timeout)
+        except multiprocessing.TimeoutError:
+            return None
+
+
+def generate_maze(size, density=0.6, seed=0):
+    rng = random.Random(seed)
+    m = [[rng.random() < density for _ in range(size)] for _ in range(size)]
+    i = j = size // 2
+    while 0 < i < size - 1 and 0 < j < size - 1:
+        m[i][j] = True
+        di, dj = rng.choice([(0, 1), (1, 0), (0, -1), (-1, 0)])
+        i, j = i + di, j + dj
+    m[i][j] = True
+    return m, (size // 2, size // 2)
+
+
+def bench_maze(sizes):
+    for size in sizes or [100, 500, 2000]:
+        m, initial = generate_maze(size)
+        for method in ["bfs", "astar", "dfs"]:
+            if method == "dfs":
+                result = timed_in_child(
+                    DFS_TIMEOUT, task.find_route, m, initial, method
+                )
+                if result is None:
+                    print(f"{size}x{size} {method:>5}: "
+                          f"gave up after {DFS_TIMEOUT}s")
+                    continue
+                elapsed, route = result
+            else:
+                elapsed, route = timed(task.find_route, m, initial, method)
+            print(f"{size}x{size} {method:>5}: {elapsed:8.3f}s, "
+                  f"route length {len(route)}")
+
+
+def generate_sequences(n, length=142, mutations=3, seed=0):
+    rng = random.Random(seed)
+    sequences = [
+        "".join(rng.choices(AMINO_ACIDS, k=length)) for _ in range(n)
+    ]
+    planted = list(sequences[n // 3])
+    for pos in rng.sample(range(length), mutations):
+        planted[pos] = rng.choice(AMINO_ACIDS.replace(planted[pos], ""))
+    sequences[2 * n // 3] = "".join(planted)
+    return sequences
+
+
+def bench_hba1(sizes):
+    for n in sizes or [1000, 3000, 10000, 100000]:
+        with tempfile.NamedTemporaryFile("w", delete=False) as f:
+            f.write("\n".join(generate_sequences(n)))
+        try:
+            for indexed in [True, False]:
+                if not indexed and n > EXHAUSTIVE_MAX_SIZE:
+                    print(f"{n:>7} exhaustive: skipped")
+                    continue
+                elapsed, pair = timed(
+                    task.hba1, f.name, task.hamming, indexed=indexed
+                )
+                label = "indexed" if indexed else "exhaustive"
+                print(f"{n:>7} {label:>10}: {elapsed:8.3f}s, pair {pair}")
+        finally:
+            os.remove(f.name)
+
+
+def legacy_distance1(seq1, seq2, k=2):
+    freqs1 = Counter(seq1[i:i + k] for i in range(len(seq1) - k + 1))
+    freqs2 = Counter(seq2[i:i + k] for i in range(len(seq2) - k + 1))
+    return sum(
+        abs(freqs1[key] - freqs2[key]) for key in freqs1.keys() | freqs2.keys()
+    )
+
+
+def scaled_hba1(scale, seed=0):
+    rng = random.Random(seed)
+    with open(os.path.join(os.path.dirname(__file__), "HBA1.txt")) as file:
+        sequences = file.read().splitlines()
+    result = []
+    for _ in range(scale):
+        for seq in sequences:
+            seq = list(seq)
+            seq[rng.randrange(len(seq))] = rng.choice(AMINO_ACIDS)
+            result.append("".join(seq))
+    return result
+
+
+def bench_kmers(scales):
+    for scale in scales or [5, 20, 50]:
+        sequences = scaled_hba1(scale)
+        for label, distance in [
+            ("legacy", legacy_distance1), ("rolling", task.distance1)
+        ]:
+            task.kmer_profile.cache_clear()
+            pairs = combinations(sequences, 2)
+            elapsed, _ = timed(lambda: [distance(*pair) for pair in pairs])
+            print(f"{len(sequences):>5} sequences {label:>7}: {elapsed:8.3f}s")
+
+
+BENCHMARKS = {"maze": bench_maze, "hba1": bench_hba1, "kmers": bench_kmers}
+
+
+if __name__ == "__main__":
+    _, name, *sizes = sys.argv
+    BENCHMARKS[name]([int(size) for size in sizes])
@@ -1,5 +1,19 @@
-from collections import Counter
-from itertools import combinations
+import functools
+import heapq
+import mmap
+import os
+import random
+import sys
+import zlib
+from array import array
+from collections import Counter, defaultdict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations, repeat
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 def shape(m):
@@ -7,22 +21,39 @@ def shape(m):
     return len(m), len(m[0])
 
 
-def print_map(m, pos):
+CELL_CHARS = bytes.maketrans(b"\x00\x01", b"#.")
+
+
+def render_map(m):
+    n_rows, n_cols = shape(m)
+    width = n_cols + 1
+    frame = bytearray(b"\n") * (n_rows * width)
     for i, row in enumerate(m):
-        for j, cell in enumerate(row):
-            if (i, j) == pos:
-                print('@', end='')
-            elif cell:
-                print('.', end='')
-            else:
-                print('#', end='')
-        print()
+        start = i * width
+        frame[start:start + n_cols] = bytes(map(bool, row)).translate(
+            CELL_CHARS
+        )
+    return frame
+
+
+def write_frame(frame, sink=None):
+    if sink is None:
+        sys.stdout.write(frame.decode("ascii"))
+    else:
+        sink.write(frame)
+
+
+def print_map(m, pos, sink=None):
+    frame = render_map(m)
+    i, j = pos
+    frame[i * (shape(m)[1] + 1) + j] = ord("@")
+    write_frame(frame, sink)
 
 
 def is_free(m, pos):
     i, j = pos
     n_rows, n_cols = shape(m)
-    return i in range(0, n_rows) and j in range(0, n_cols) and m[i][j]
+    return 0 <= i < n_rows and 0 <= j < n_cols and m[i][j]
 
 
 def neighbours(m, pos):
@@ -41,10 +72,10 @@ def is_exit(m, pos):
     i, j = pos
     n_rows, n_cols = shape(m)
 
-    return (i in {0, n_rows - 1} or j in {0, n_cols - 1}) and m[i][j]
+    return (i in (0, n_rows - 1) or j in (0, n_cols - 1)) and m[i][j]
 
 
-def find_route(m, initial):
+def find_route_dfs(m, initial):
     stack = [([], initial)]
     while stack:
         route, pos = stack.pop()
@@ -57,11 +88,112 @@ def find_route(m, initial):
     assert False
 
 
-def escape(m, initial):
+def flat_grid(m):
+    n_rows, n_cols = shape(m)
+    return n_rows, n_cols, bytearray(bool(cell) for row in m for cell in row)
+
+
+def unwind(parents, cell, n_cols):
+    route = [divmod(cell, n_cols)]
+    while parents[cell] != cell:
+        cell = parents[cell]
+        route.append(divmod(cell, n_cols))
+    route.reverse()
+    return route
+
+
+def find_route_bfs(m, initial):
+    n_rows, n_cols, grid = flat_grid(m)
+    start = initial[0] * n_cols + initial[1]
+    parents = array("q", [-1]) * len(grid)
+    parents[start] = start
+    queue = deque([start])
+    while queue:
+        cell = queue.popleft()
+        i, j = divmod(cell, n_cols)
+        if i in (0, n_rows - 1) or j in (0, n_cols - 1):
+            if grid[cell]:
+                return unwind(parents, cell, n_cols)
+            continue
+        # Only interior cells get here, so all four neighbours are in bounds.
+        for candidate in (cell + 1, cell + n_cols, cell - 1, cell - n_cols):
+            if grid[candidate] and parents[candidate] < 0:
+                parents[candidate] = cell
+                queue.append(candidate)
+    assert False
+
+
+def find_route_astar(m, initial):
+    n_rows, n_cols, grid = flat_grid(m)
+
+    def to_border(cell):
+        i, j = divmod(cell, n_cols)
+        return min(i, n_rows - 1 - i, j, n_cols - 1 - j)
+
+    start = initial[0] * n_cols + initial[1]
+    parents = array("q", [-1]) * len(grid)
+    costs = array("q", [-1]) * len(grid)
+    parents[start], costs[start] = start, 0
+    heap = [(to_border(start), 0, start)]
+    while heap:
+        _, cost, cell = heapq.heappop(heap)
+        if cost > costs[cell]:
+            continue
+        i, j = divmod(cell, n_cols)
+        if i in (0, n_rows - 1) or j in (0, n_cols - 1):
+            if grid[cell]:
+                return unwind(parents, cell, n_cols)
+            continue
+        cost += 1
+        for candidate in (cell + 1, cell + n_cols, cell - 1, cell - n_cols):
+            if grid[candidate] and not 0 <= costs[candidate] <= cost:
+                parents[candidate], costs[candidate] = cell, cost
+                heapq.heappush(
+                    heap, (cost + to_border(candidate), cost, candidate)
+                )
+    assert False
+
+
+ROUTE_FINDERS = {
+    "dfs": find_route_dfs,
+    "bfs": find_route_bfs,
+    "astar": find_route_astar,
+}
+
+
+def find_route(m, initial, method="bfs"):
+    return ROUTE_FINDERS[method](m, initial)
+
+
+def escape(m, initial, sink=None, diff=False):
     route = find_route(m, initial)
-    for pos in route:
-        print_map(m, pos)
-        print()
+    frame = render_map(m) + b"\n"
+    width = shape(m)[1] + 1
+    if diff:
+        escape_diff(frame, width, route, sink)
+        return
+
+    for i, j in route:
+        cell = i * width + j
+        frame[cell] = ord("@")
+        write_frame(frame, sink)
+        frame[cell] = ord(".")
+
+
+def escape_diff(frame, width, route, sink=None):
+    # Draws the map once and then only moves '@' around with ANSI cursor
+    # positioning, so the output is linear in the route length.
+    (i, j), *steps = route
+    start = i * width + j
+    frame[start] = ord("@")
+    write_frame(b"\x1b[2J\x1b[H" + frame, sink)
+    frame[start] = ord(".")
+
+    for next_i, next_j in steps:
+        move = (i + 1, j + 1, next_i + 1, next_j + 1)
+        write_frame(b"\x1b[%d;%dH.\x1b[%d;%dH@" % move, sink)
+        i, j = next_i, next_j
+    write_frame(b"\x1b[%d;1H" % (len(frame) // width + 1), sink)
 
 
 def hamming(seq1, seq2):
@@ -71,26 +203,330 @@ def hamming(seq1, seq2):
     return sum(ch1 != ch2 for ch1, ch2 in zip(seq1, seq2))
 
 
-def hba1(path, distance):
-    line1, line2 = -1, -1
-    min_distance = float('inf')
+def hba1(path, distance, chunk_size=2 ** 24, indexed=False, workers=None):
+    if workers is not None:
+        return parallel_closest_pair(path, distance, workers)
     with open(path) as file:
         sequences = file.read().splitlines()
-        for (i, seq1), (j, seq2) in combinations(enumerate(sequences), 2):
-            current_distance = distance(seq1, seq2)
-            if current_distance < min_distance:
-                min_distance = current_distance
-                line1, line2 = i + 1, j + 1
+    if len(sequences) < 2:
+        return -1, -1
+    if indexed and distance in INDEXED_DISTANCES:
+        return INDEXED_DISTANCES[distance](sequences)
+    if np is not None and distance in BATCHED_DISTANCES:
+        return BATCHED_DISTANCES[distance](sequences, chunk_size)
+    return exhaustive_closest_pair(sequences, distance)
+
+
+def exhaustive_closest_pair(sequences, distance):
+    line1, line2 = -1, -1
+    min_distance = float('inf')
+    for (i, seq1), (j, seq2) in combinations(enumerate(sequences), 2):
+        current_distance = distance(seq1, seq2)
+        if current_distance < min_distance:
+            min_distance = current_distance
+            line1, line2 = i + 1, j + 1
     return line1, line2
 
 
+Encoding = namedtuple("Encoding", ["bits", "alphabet"])
+
+# Tried in order, the first one covering every character of the input wins.
+# Each alphabet extends the previous one, ``alphabet=None`` falls back to raw
+# code points.
+ENCODINGS = [
+    Encoding(2, "ACGT"),
+    Encoding(5, "ACDEFGHIKLMNPQRSTVWYBJOUXZ*-"),
+    Encoding(21, None),
+]
+SYMBOLS = {
+    encoding.alphabet: {char: i for i, char in enumerate(encoding.alphabet)}
+    for encoding in ENCODINGS if encoding.alphabet is not None
+}
+
+KmerProfile = namedtuple("KmerProfile", ["codes", "counts"])
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def encoding_rank(seq):
+    chars = set(seq)
+    return next(
+        rank for rank, encoding in enumerate(ENCODINGS)
+        if encoding.alphabet is None or chars.issubset(encoding.alphabet)
+    )
+
+
+def pick_encoding(*seqs):
+    return ENCODINGS[max(map(encoding_rank, seqs), default=0)]
+
+
+def kmer_codes(seq, k, encoding):
+    bits, alphabet = encoding
+    if alphabet is None:
+        symbols = map(ord, seq)
+    else:
+        symbols = map(SYMBOLS[alphabet].__getitem__, seq)
+    mask = (1 << bits * k) - 1
+    code, codes = 0, []
+    for i, symbol in enumerate(symbols):
+        code = (code << bits | symbol) & mask
+        if i >= k - 1:
+            codes.append(code)
+    return codes
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def kmer_profile(seq, k, encoding):
+    freqs = sorted(Counter(kmer_codes(seq, k, encoding)).items())
+    codes = [code for code, _ in freqs]
+    if encoding.bits * k <= 64:
+        codes = array("Q", codes)
+    return KmerProfile(codes, array("L", [count for _, count in freqs]))
+
+
+def profile_distance(profile1, profile2):
+    counts2 = dict(zip(*profile2))
+    overlap = sum(
+        min(count, counts2.get(code, 0)) for code, count in zip(*profile1)
+    )
+    return sum(profile1.counts) + sum(profile2.counts) - 2 * overlap
+
+
 def kmers(seq, k):
     return Counter(seq[i:i + k] for i in range(len(seq) - k + 1))
 
 
 def distance1(seq1, seq2, k=2):
-    freqs1 = kmers(seq1, k)
-    freqs2 = kmers(seq2, k)
-    return sum(
-        abs(freqs1[key] - freqs2[key]) for key in freqs1.keys() | freqs2.keys()
+    encoding = pick_encoding(seq1, seq2)
+    return profile_distance(
+        kmer_profile(seq1, k, encoding), kmer_profile(seq2, k, encoding)
     )
+
+
+def encode(sequences):
+    assert all(len(seq) == len(sequences[0]) for seq in sequences), (
+        "Sequences are of unequal lengths"
+    )
+    codes = np.frombuffer(
+        "".join(sequences).encode("utf-32-le"), dtype=np.uint32
+    )
+    return codes.reshape(len(sequences), -1)
+
+
+def kmer_profiles(sequences, k):
+    encoding = pick_encoding(*sequences)
+    freqs = [kmer_profile(seq, k, encoding) for seq in sequences]
+    vocabulary = {}
+    for codes, _ in freqs:
+        for code in codes:
+            vocabulary.setdefault(code, len(vocabulary))
+    profiles = np.zeros((len(sequences), len(vocabulary)), dtype=np.int32)
+    for profile, (codes, counts) in zip(profiles, freqs):
+        profile[[vocabulary[code] for code in codes]] = counts
+    return profiles
+
+
+def closest_pair(rows, metric, chunk_size):
+    # Compares a block of rows against all the rows after its first one, so
+    # that at most ``chunk_size`` cells are compared at once. Row-major
+    # argmin keeps the first minimal pair in ``combinations`` order.
+    n_rows, width = rows.shape
+    step = max(1, chunk_size // max(1, n_rows * width))
+    line1, line2 = -1, -1
+    min_distance = np.iinfo(np.int64).max
+    for start in range(0, n_rows - 1, step):
+        block = rows[start:start + step]
+        others = rows[start + 1:]
+        distances = metric(block[:, None, :], others[None, :, :]).sum(
+            axis=-1, dtype=np.int64
+        )
+        i, j = np.indices(distances.shape)
+        distances[j < i] = np.iinfo(np.int64).max
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        if distances[i, j] < min_distance:
+            min_distance = distances[i, j]
+            line1, line2 = start + i + 1, start + j + 2
+    return int(line1), int(line2)
+
+
+def hamming_closest_pair(sequences, chunk_size):
+    return closest_pair(encode(sequences), np.not_equal, chunk_size)
+
+
+def distance1_closest_pair(sequences, chunk_size, k=2):
+    return closest_pair(
+        kmer_profiles(sequences, k), lambda p, q: np.abs(p - q), chunk_size
+    )
+
+
+BATCHED_DISTANCES = {
+    hamming: hamming_closest_pair,
+    distance1: distance1_closest_pair,
+}
+
+
+def segments(length, n):
+    bounds = [length * s // n for s in range(n + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def bucket_pairs(keys):
+    buckets = defaultdict(list)
+    for idx, key in enumerate(keys):
+        buckets[key].append(idx)
+    for bucket in buckets.values():
+        yield from combinations(bucket, 2)
+
+
+def closest_candidate(sequences, distance, candidates):
+    return min(
+        ((distance(sequences[i], sequences[j]), i, j) for i, j in candidates),
+        default=None
+    )
+
+
+def indexed_hamming_closest_pair(sequences):
+    # Pigeonhole: two sequences within distance d agree exactly on at least
+    # one of d + 1 segments, so every such pair shares some segment bucket.
+    length = len(sequences[0]) if sequences else 0
+    threshold = 0
+    while threshold < length:
+        candidates = set()
+        for start, stop in segments(length, threshold + 1):
+            candidates.update(
+                bucket_pairs(seq[start:stop] for seq in sequences)
+            )
+        best = closest_candidate(sequences, hamming, candidates)
+        if best is not None and best[0] <= threshold:
+            _, i, j = best
+            return i + 1, j + 1
+        threshold = 2 * threshold + 1
+    return exhaustive_closest_pair(sequences, hamming)
+
+
+MINHASH_PRIME = (1 << 61) - 1
+
+
+def minhash_signatures(sequences, k, n_hashes, seed=0):
+    rng = random.Random(seed)
+    coefficients = [
+        (rng.randrange(1, MINHASH_PRIME), rng.randrange(MINHASH_PRIME))
+        for _ in range(n_hashes)
+    ]
+    signatures = []
+    for seq in sequences:
+        # Numbering repeated k-mers turns the profile multiset into a set,
+        # so that Jaccard similarity tracks the L1 distance of profiles.
+        shingles = [
+            zlib.crc32(f"{kmer}:{copy}".encode())
+            for kmer, count in kmers(seq, k).items()
+            for copy in range(count)
+        ] or [0]
+        signatures.append(tuple(
+            min((a * x + b) % MINHASH_PRIME for x in shingles)
+            for a, b in coefficients
+        ))
+    return signatures
+
+
+def indexed_distance1_closest_pair(sequences, k=2, bands=16, rows=4):
+    # Approximate: only pairs colliding in at least one LSH band are checked.
+    signatures = minhash_signatures(sequences, k, bands * rows)
+    candidates = set()
+    for band in range(0, bands * rows, rows):
+        candidates.update(
+            bucket_pairs(sig[band:band + rows] for sig in signatures)
+        )
+    best = closest_candidate(
+        sequences, lambda seq1, seq2: distance1(seq1, seq2, k), candidates
+    )
+    if best is None:
+        return exhaustive_closest_pair(sequences, distance1)
+    _, i, j = best
+    return i + 1, j + 1
+
+
+INDEXED_DISTANCES = {
+    hamming: indexed_hamming_closest_pair,
+    distance1: indexed_distance1_closest_pair,
+}
+
+
+def line_offsets(buffer):
+    offsets = array("q", [0])
+    pos = buffer.find(b"\n")
+    while pos >= 0:
+        offsets.append(pos + 1)
+        pos = buffer.find(b"\n", pos + 1)
+    if offsets[-1] != len(buffer):
+        offsets.append(len(buffer) + 1)
+    return offsets
+
+
+def open_lines(path):
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return buffer, line_offsets(buffer)
+
+
+shard = None
+
+
+def init_shard(path):
+    global shard
+    shard = open_lines(path)
+
+
+def read_lines(start, stop):
+    buffer, offsets = shard
+    return [
+        buffer[offsets[i]:offsets[i + 1] - 1].decode().rstrip("\r")
+        for i in range(start, stop)
+    ]
+
+
+def tile_closest_pair(distance, rows1, rows2):
+    seqs1, seqs2 = read_lines(*rows1), read_lines(*rows2)
+    best = None
+    for i, seq1 in enumerate(seqs1, rows1[0]):
+        for j, seq2 in enumerate(seqs2, rows2[0]):
+            if j <= i:
+                continue
+            current_distance = distance(seq1, seq2)
+            if best is None or current_distance < best[0]:
+                best = current_distance, i, j
+    return best
+
+
+def triangle_tiles(n, tile_size):
+    bounds = [
+        (start, min(start + tile_size, n)) for start in range(0, n, tile_size)
+    ]
+    for idx, rows1 in enumerate(bounds):
+        for rows2 in bounds[idx:]:
+            yield rows1, rows2
+
+
+def parallel_closest_pair(path, distance, workers, tiles_per_worker=8):
+    if not os.path.getsize(path):
+        return -1, -1
+    buffer, offsets = open_lines(path)
+    n = len(offsets) - 1
+    buffer.close()
+
+    # Off-diagonal tiles are equal squares, so splitting the triangle into
+    # about ``tiles_per_worker`` tiles per worker keeps the load balanced.
+    n_blocks = max(1, int((2 * tiles_per_worker * workers) ** 0.5))
+    tile_size = max(1, -(-n // n_blocks))
+    rows1, rows2 = zip(*triangle_tiles(n, tile_size))
+    with ProcessPoolExecutor(
+        workers, initializer=init_shard, initargs=(path,)
+    ) as executor:
+        results = executor.map(
+            tile_closest_pair, repeat(distance), rows1, rows2
+        )
+        # Ties are broken by line numbers, exactly like the serial scan.
+        best = min((result for result in results if result), default=None)
+    if best is None:
+        return -1, -1
+    _, i, j = best
+    return i + 1, j + 1
@@ -1,15 +1,132 @@
 import functools
+import threading
+import time
+from collections import Counter
+from itertools import chain
 
 
-def trace(f):
+class TraceStats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.sampled = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+        self.arg_sizes = Counter()
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "sampled": self.sampled,
+            "total_time": self.total_time,
+            "self_time": self.self_time,
+            "arg_sizes": {
+                2 ** bucket: count
+                for bucket, count in sorted(self.arg_sizes.items())
+            },
+        }
+
+
+TRACE_STATS = {}
+timings = threading.local()
+
+
+def format_call(args, kwargs):
+    return ", ".join(
+        [str(a) for a in args] + [f"{k}={v}" for k, v in kwargs.items()]
+    )
+
+
+def arg_size(args, kwargs):
+    return sum(
+        len(a) if hasattr(a, "__len__") else 1
+        for a in chain(args, kwargs.values())
+    )
+
+
+def trace(f=None, *, aggregate=False, every=1):
+    if every < 1:
+        raise ValueError("every must be positive")
+    if f is None:
+        return functools.partial(trace, aggregate=aggregate, every=every)
+    if aggregate:
+        stats = TRACE_STATS.setdefault(
+            f"{f.__module__}.{f.__qualname__}", TraceStats()
+        )
+        return trace_aggregate(f, stats, every)
+
+    calls = 0
+
     @functools.wraps(f)
     def inner(*args, **kwargs):
-        call = ", ".join(
-            [str(a) for a in args] + [f"{k}={v}" for k, v in kwargs.items()]
-        )
+        nonlocal calls
+        calls += 1
+        if (calls - 1) % every:
+            return f(*args, **kwargs)
+
+        call = format_call(args, kwargs)
         print(f"{f.__name__}({call}) = ...")
         ret = f(*args, **kwargs)
         print(f"{f.__name__}({call}) = {ret}")
         return ret
 
     return inner
+
+
+def trace_aggregate(f, stats, every):
+    @functools.wraps(f)
+    def inner(*args, **kwargs):
+        stats.calls += 1
+        sampled = not (stats.calls - 1) % every
+        stack = timings.__dict__.setdefault("stack", [])
+        # Unsampled calls are still timed inside a sampled one, otherwise
+        # their time would end up in the caller's self time.
+        if not sampled and not stack:
+            return f(*args, **kwargs)
+
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            if sampled:
+                stats.sampled += 1
+                stats.total_time += elapsed
+                stats.self_time += elapsed - children
+                stats.arg_sizes[arg_size(args, kwargs).bit_length()] += 1
+
+    return inner
+
+
+def trace_dump():
+    return {name: stats.as_dict() for name, stats in TRACE_STATS.items()}
+
+
+def trace_report(file=None):
+    print(
+        f"{'function':<30} {'calls':>10} {'sampled':>10} "
+        f"{'total, s':>10} {'self, s':>10}",
+        file=file
+    )
+    by_self_time = sorted(
+        TRACE_STATS.items(), key=lambda item: item[1].self_time, reverse=True
+    )
+    for name, stats in by_self_time:
+        print(
+            f"{name:<30} {stats.calls:>10} {stats.sampled:>10} "
+            f"{stats.total_time:>10.6f} {stats.self_time:>10.6f}",
+            file=file
+        )
+        for bucket, count in sorted(stats.arg_sizes.items()):
+            print(f"    arg size < {2 ** bucket:<10} {count:>10}", file=file)
+
+
+def trace_reset():
+    for stats in TRACE_STATS.values():
+        stats.reset()
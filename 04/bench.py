@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+from array import array
+from itertools import islice, tee
+
+import task
+
+CORPUS = os.path.join(os.path.dirname(__file__), "snoopdogg279.txt")
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+def legacy_find_all(s, sub):
+    return [i for i in range(len(s)) if s[i:].startswith(sub)]
+
+
+def bench_find_all(sizes):
+    with open(CORPUS) as file:
+        corpus = file.read()
+    for size in sizes or [10000, 50000, len(corpus)]:
+        s = corpus[:size]
+        for label, find_all in [
+            ("str.find", task.find_all), ("legacy", legacy_find_all)
+        ]:
+            if find_all is legacy_find_all and size > 100000:
+                print(f"{size:>7} {label:>8}: skipped")
+                continue
+            elapsed, found = timed(find_all, s, "the")
+            print(f"{size:>7} {label:>8}: {elapsed:8.3f}s, {len(found)} found")
+
+        subs = ["the", "he", "she", "his", "hers", "dogg", "money"]
+        elapsed, _ = timed(task.find_many, s, subs)
+        one_by_one, _ = timed(lambda: [task.find_all(s, sub) for sub in subs])
+        print(f"{size:>7} {len(subs)} patterns: aho-corasick {elapsed:.3f}s, "
+              f"one by one {one_by_one:.3f}s")
+
+
+def legacy_sliding(iterable, n, step):
+    return zip(
+        *(islice(it, i, None, step) for i, it in enumerate(tee(iterable, n)))
+    )
+
+
+def bench_sliding(sizes):
+    data = array("d", range(10 ** 6))
+    for n in sizes or [2, 16, 128, 1024]:
+        for step in sorted({1, n // 2 or 1, 2 * n}):
+            timings = []
+            for sliding in [legacy_sliding, task.sliding, task.sliding_view]:
+                windows = sliding(data, n, step)
+                elapsed, _ = timed(lambda: sum(1 for _ in windows))
+                timings.append(f"{sliding.__name__} {elapsed:.3f}s")
+            print(f"n={n:<5} step={step:<5}", ", ".join(timings))
+
+
+BENCHMARKS = {"find_all": bench_find_all, "sliding": bench_sliding}
+
+
+if __name__ == "__main__":
+    _, name, *sizes = sys.argv
+    BENCHMARKS[name]([int(size) for size in sizes])
@@ -1,9 +1,35 @@
 import bz2
+import codecs
 import gzip
-from collections import defaultdict
-from itertools import islice, tee
+import io
+import mmap
+import os
+import random
+import re
+import struct
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import accumulate, chain, islice, repeat, tee
 from random import choice, choices
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
 
 def capwords(s, sep=None):
     return (sep or " ").join(x.capitalize() for x in s.split(sep))
@@ -22,8 +48,60 @@ def boxed(s, fill, pad):
     return "\n".join([line, s, line])
 
 
+def iter_find_all(s, sub):
+    pos = s.find(sub)
+    while 0 <= pos < len(s):
+        yield pos
+        pos = s.find(sub, pos + 1)
+
+
 def find_all(s, sub):
-    return [i for i in range(len(s)) if s[i:].startswith(sub)]
+    return list(iter_find_all(s, sub))
+
+
+def aho_corasick(subs):
+    assert all(subs), "substrings must be non-empty"
+    goto, fail, output = [{}], [0], [[]]
+    for sub in subs:
+        state = 0
+        for char in sub:
+            if char not in goto[state]:
+                goto[state][char] = len(goto)
+                goto.append({})
+                fail.append(0)
+                output.append([])
+            state = goto[state][char]
+        output[state].append(sub)
+
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, next_state in goto[state].items():
+            queue.append(next_state)
+            fallback = fail[state]
+            while fallback and char not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[next_state] = goto[fallback].get(char, 0)
+            output[next_state] += output[fail[next_state]]
+    return goto, fail, output
+
+
+def iter_find_many(s, subs):
+    goto, fail, output = aho_corasick(list(dict.fromkeys(subs)))
+    state = 0
+    for i, char in enumerate(s):
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        for sub in output[state]:
+            yield i - len(sub) + 1, sub
+
+
+def find_many(s, subs):
+    result = {sub: [] for sub in subs}
+    for pos, sub in iter_find_many(s, subs):
+        result[sub].append(pos)
+    return result
 
 
 def common_prefix(s1, s2, *rest):
@@ -34,12 +112,187 @@ def common_prefix(s1, s2, *rest):
     return min(strings)
 
 
-def reader(filename, **kwargs):
-    if filename.endswith(".bz2"):
-        return bz2.open(filename, **kwargs)
-    if filename.endswith(".gz"):
-        return gzip.open(filename, **kwargs)
-    return open(filename, **kwargs)
+OPENERS = {".bz2": bz2.open, ".gz": gzip.open}
+if lzma is not None:
+    OPENERS[".xz"] = lzma.open
+if zstd is not None:
+    OPENERS[".zst"] = zstd.open
+
+MAGIC = [
+    (re.compile(rb"\x1f\x8b\x08"), ".gz"),
+    (re.compile(rb"BZh[1-9](1AY&SY|\x17rE8P\x90)"), ".bz2"),
+    (re.compile(rb"\xfd7zXZ\x00"), ".xz"),
+    (re.compile(rb"\x28\xb5\x2f\xfd"), ".zst"),
+]
+
+# Start of a gzip member (with reserved flag bits unset) or of a bz2 stream
+# followed by its first block.
+MEMBER_MAGIC = {
+    ".gz": re.compile(rb"\x1f\x8b\x08[\x00-\x1f]"),
+    ".bz2": re.compile(rb"BZh[1-9]1AY&SY"),
+}
+
+
+def sniff(filename):
+    with open(filename, "rb") as file:
+        head = file.read(10)
+    return next(
+        (
+            codec for magic, codec in MAGIC
+            if codec in OPENERS and magic.match(head)
+        ),
+        None
+    )
+
+
+def new_decompressor(codec):
+    if codec == ".gz":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return bz2.BZ2Decompressor()
+
+
+def decompress_member(segment, codec):
+    decompressor = new_decompressor(codec)
+    try:
+        data = decompressor.decompress(segment)
+    except (OSError, zlib.error):
+        return None
+    if not decompressor.eof or decompressor.unused_data:
+        return None
+    return data
+
+
+def decompress_stream(chunks, codec):
+    # Sequential decompression of back to back members.
+    decompressor, fed = new_decompressor(codec), False
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            fed, chunk = True, b""
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor, fed = new_decompressor(codec), False
+    if fed:
+        raise EOFError(
+            "Compressed file ended before the end-of-stream marker was reached"
+        )
+
+
+def decompress_parallel(filename, codec, threads, chunk_size=1 << 20,
+                        max_member=1 << 26):
+    # Yields decompressed members in file order, with at most 2 * threads
+    # of them in flight. A member over ``max_member`` bytes, e.g. in a file
+    # compressed as a single stream, can't be split: the rest of the file
+    # is then decompressed sequentially.
+    magic = MEMBER_MAGIC[codec]
+    window, pending = deque(), b""
+
+    def drain(limit):
+        # A magic number may also occur inside compressed data. Such a false
+        # split makes both halves fail, so they are glued back and retried.
+        nonlocal pending
+        while len(window) > limit:
+            segment, future = window.popleft()
+            result = future.result()
+            if pending or result is None:
+                pending += segment
+                result = decompress_member(pending, codec)
+                if result is None:
+                    continue
+                pending = b""
+            yield result
+
+    with open(filename, "rb") as file, ThreadPoolExecutor(threads) as executor:
+        chunks = iter(lambda: file.read(chunk_size), b"")
+        buffer, start = bytearray(), 1
+        for chunk in chunks:
+            buffer += chunk
+            match = magic.search(buffer, start)
+            while match:
+                segment = bytes(buffer[:match.start()])
+                del buffer[:match.start()]
+                window.append((
+                    segment,
+                    executor.submit(decompress_member, segment, codec)
+                ))
+                yield from drain(2 * threads)
+                match = magic.search(buffer, 1)
+            if len(buffer) > max_member:
+                break
+            # Leaves room for a magic number cut in half by the chunk end.
+            start = max(1, len(buffer) - 16)
+        else:
+            chunks = iter([])
+        yield from drain(0)
+        yield from decompress_stream(
+            chain([pending, bytes(buffer)], chunks), codec
+        )
+
+
+class ChunkStream(io.RawIOBase):
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.pending = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.pending = memoryview(chunk)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        self.chunks.close()
+        super().close()
+
+
+def reader(filename, buffer_size=None, threads=None, **kwargs):
+    mode = kwargs.get("mode", "r")
+    if "r" in mode:
+        codec = sniff(filename) or os.path.splitext(filename)[1]
+    else:
+        codec = os.path.splitext(filename)[1]
+    if codec not in OPENERS:
+        if buffer_size is not None:
+            kwargs["buffering"] = buffer_size
+        return open(filename, **kwargs)
+    if "r" not in mode or buffer_size is None and threads is None:
+        return OPENERS[codec](filename, **kwargs)
+
+    mode = kwargs.pop("mode", "rb")
+    if threads is not None and codec in MEMBER_MAGIC:
+        handle = io.BufferedReader(
+            ChunkStream(decompress_parallel(filename, codec, threads)),
+            buffer_size or io.DEFAULT_BUFFER_SIZE
+        )
+    else:
+        handle = io.BufferedReader(
+            OPENERS[codec](filename, "rb"),
+            buffer_size or io.DEFAULT_BUFFER_SIZE
+        )
+    if "t" in mode:
+        return io.TextIOWrapper(handle, **kwargs)
+    return handle
+
+
+def iter_chunks(filename, buffer_size=1 << 20, threads=None):
+    with reader(filename, buffer_size, threads, mode="rb") as handle:
+        # Every chunk is a view onto the same buffer and is only valid
+        # until the next one is read; copy it with bytes() to keep it.
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        while True:
+            size = handle.readinto(buffer)
+            if not size:
+                break
+            yield view[:size]
 
 
 def parse_shebang(filename):
@@ -51,10 +304,150 @@ def words(handle):
     return [word for line in handle for word in line.split(" ")]
 
 
-def sliding(iterable, n, step):
-    return zip(
-        *(islice(it, i, None, step) for i, it in enumerate(tee(iterable, n)))
+def tokenize(chunks):
+    # Same tokens as ``words``, but the text may be cut anywhere: only the
+    # last, possibly unfinished word of a chunk is carried over.
+    tail, open_line = "", False
+    for chunk in filter(None, chunks):
+        *lines, last = (tail + chunk).split("\n")
+        for line in lines:
+            *rest, end = line.split(" ")
+            yield from rest
+            yield end + "\n"
+        *rest, tail = last.split(" ")
+        yield from rest
+        open_line = bool(last)
+    if open_line:
+        yield tail
+
+
+def iter_words(handle, chunk_size=1 << 20):
+    return tokenize(iter(lambda: handle.read(chunk_size), ""))
+
+
+def read_range(path, start, stop, chunk_size=1 << 20, encoding="utf-8"):
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder(encoding)(), translate=True
     )
+    with open(path, "rb") as file:
+        file.seek(start)
+        while start < stop:
+            chunk = file.read(min(chunk_size, stop - start))
+            if not chunk:
+                break
+            start += len(chunk)
+            yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def split_ranges(path, n):
+    size = os.path.getsize(path)
+    bounds = [0]
+    with open(path, "rb") as file:
+        for i in range(1, n):
+            file.seek(max(size * i // n, bounds[-1]))
+            file.readline()
+            bounds.append(file.tell())
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def count_transitions(tokens, order=2):
+    unigrams, transitions = Counter(), defaultdict(Counter)
+    state, head = deque(maxlen=order), []
+    for token in tokens:
+        unigrams[token] += 1
+        if len(state) == order:
+            transitions[tuple(state)][token] += 1
+        else:
+            head.append(token)
+        state.append(token)
+    return unigrams, transitions, head, list(state)
+
+
+def count_range(path, start, stop, order=2):
+    return count_transitions(tokenize(read_range(path, start, stop)), order)
+
+
+def merge_counts(parts, order=2):
+    # Each part misses the windows that cross its boundaries. They are
+    # restored from the last ``order`` tokens seen so far (the carry) and the
+    # first ``order`` tokens of the next part.
+    unigrams, transitions = Counter(), defaultdict(Counter)
+    carry = []
+    for part_unigrams, part_transitions, head, tail in parts:
+        unigrams.update(part_unigrams)
+        for state, counts in part_transitions.items():
+            transitions[state].update(counts)
+        tokens = carry + head
+        for start in range(len(carry)):
+            stop = start + order
+            if stop < len(tokens):
+                transitions[tuple(tokens[start:stop])][tokens[stop]] += 1
+        carry = (carry + tail)[-order:]
+    return unigrams, transitions
+
+
+def sliding(iterable, n, step):
+    if step < 1:
+        raise ValueError("step must be positive")
+    # zip over tee'd iterators does all the work in C and wins for small
+    # windows. Large strides are cheaper to skip with islice than to
+    # buffer in every tee'd iterator.
+    if step == 1 or n * step <= 64:
+        return zip(
+            *(islice(it, i, None, step)
+              for i, it in enumerate(tee(iterable, n)))
+        )
+    return iter_windows(iterable, n, step)
+
+
+def iter_windows(iterable, n, step):
+    it = iter(iterable)
+    window = deque(islice(it, n), maxlen=n)
+    if len(window) < n:
+        return
+    yield tuple(window)
+    if step >= n:
+        while True:
+            items = tuple(islice(it, step - n, step))
+            if len(items) < n:
+                return
+            yield items
+
+    while True:
+        items = tuple(islice(it, step))
+        if len(items) < step:
+            return
+        window.extend(items)
+        yield tuple(window)
+
+
+def sliding_view(iterable, n, step, typecode="d"):
+    # Yields read-only memoryviews instead of tuples. A view is only valid
+    # until the next one is requested, copy it to keep the window.
+    if step < 1:
+        raise ValueError("step must be positive")
+    if not n:
+        return
+    try:
+        view = memoryview(iterable).toreadonly()
+    except TypeError:
+        pass
+    else:
+        yield from (view[i:i + n] for i in range(0, len(view) - n + 1, step))
+        return
+
+    # Every item is written twice, to ``pos`` and ``pos + n``, so the last
+    # ``n`` items are always contiguous in ``buffer[pos:pos + n]``.
+    buffer = array(typecode, bytes(2 * n * array(typecode).itemsize))
+    view = memoryview(buffer).toreadonly()
+    pos = 0
+    for i, item in enumerate(iterable):
+        buffer[pos] = buffer[pos + n] = item
+        pos = (pos + 1) % n
+        if i >= n - 1 and (i - n + 1) % step == 0:
+            yield view[pos:pos + n]
 
 
 def transition_matrix(language):
@@ -72,7 +465,235 @@ def markov_chain(language, matrix, n):
     return " ".join(result)
 
 
-def snoop_says(filename, n):
-    with open(filename) as file:
-        language = words(file)
-        return markov_chain(language, transition_matrix(language), n)
+class MarkovModel:
+    # File layout: header, then the uint64 arrays ``word_offsets``,
+    # ``word_weights``, ``keys``, ``indptr``, ``weights``, then the uint32
+    # ``targets`` and finally the UTF-8 blob with all the words.
+    MAGIC = b"MKV1"
+    HEADER = struct.Struct("<4sQQQQQ")
+
+    def __init__(self, order, blob, word_offsets, word_weights,
+                 keys, indptr, targets, weights, buffer=None):
+        self.order = order
+        self.blob = blob
+        self.word_offsets = word_offsets
+        self.word_weights = word_weights
+        self.keys = keys
+        self.indptr = indptr
+        self.targets = targets
+        self.weights = weights
+        self.buffer = buffer
+        self.global_cumweights = None
+        self.n_words = len(word_weights)
+        self.check_order(self.n_words, order)
+
+    @classmethod
+    def from_words(cls, language, order=2):
+        # The vocabulary isn't known yet, only the lower bound applies.
+        cls.check_order(0, order)
+        unigrams, transitions, _, _ = count_transitions(language, order)
+        return cls.from_counts(unigrams, transitions, order)
+
+    @classmethod
+    def from_file(cls, path, order=2, workers=None):
+        cls.check_order(0, order)
+        if workers is None:
+            with open(path) as file:
+                return cls.from_words(iter_words(file), order)
+
+        starts, stops = zip(*split_ranges(path, workers))
+        with ProcessPoolExecutor(workers) as executor:
+            parts = executor.map(
+                count_range, repeat(path), starts, stops, repeat(order)
+            )
+            unigrams, transitions = merge_counts(parts, order)
+        return cls.from_counts(unigrams, transitions, order)
+
+    @classmethod
+    def from_counts(cls, unigrams, transitions, order):
+        vocabulary = list(unigrams)
+        cls.check_order(len(vocabulary), order)
+        ids = {word: i for i, word in enumerate(vocabulary)}
+        encoded = [word.encode() for word in vocabulary]
+        rows = sorted(
+            (cls.encode_state([ids[w] for w in state], len(ids)), counts)
+            for state, counts in transitions.items()
+        )
+        keys, indptr = array("Q"), array("Q", [0])
+        targets, weights = array("I"), array("Q")
+        for key, counts in rows:
+            keys.append(key)
+            targets.extend(ids[word] for word in counts)
+            weights.extend(accumulate(counts.values()))
+            indptr.append(len(targets))
+        return cls(
+            order,
+            b"".join(encoded),
+            array("Q", accumulate(map(len, encoded), initial=0)),
+            array("Q", accumulate(unigrams.values())),
+            keys, indptr, targets, weights
+        )
+
+    @staticmethod
+    def check_order(n_words, order):
+        if order < 1:
+            raise ValueError(f"order must be at least 1, got {order}")
+        # States are stored as mixed-radix uint64 keys.
+        if n_words ** order >= 2 ** 64:
+            max_order = 0
+            while n_words ** (max_order + 1) < 2 ** 64:
+                max_order += 1
+            raise ValueError(
+                f"a chain of order {order} over {n_words} words doesn't fit "
+                f"64-bit state keys, the highest usable order is {max_order}"
+            )
+
+    @staticmethod
+    def encode_state(state, n_words):
+        key = 0
+        for word_id in state:
+            key = key * n_words + word_id
+        return key
+
+    def save(self, path):
+        with open(path, "wb") as file:
+            file.write(self.HEADER.pack(
+                self.MAGIC, self.order, self.n_words, len(self.keys),
+                len(self.targets), len(self.blob)
+            ))
+            for section in [self.word_offsets, self.word_weights, self.keys,
+                            self.indptr, self.weights, self.targets]:
+                file.write(memoryview(section).cast("B"))
+            file.write(self.blob)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, order, n_words, n_states, n_transitions, blob_size = (
+            cls.HEADER.unpack_from(buffer)
+        )
+        assert magic == cls.MAGIC, f"{path} is not a Markov model"
+        view, offset = memoryview(buffer), cls.HEADER.size
+        sections = []
+        for typecode, size in [("Q", n_words + 1), ("Q", n_words),
+                               ("Q", n_states), ("Q", n_states + 1),
+                               ("Q", n_transitions), ("I", n_transitions)]:
+            stop = offset + size * array(typecode).itemsize
+            sections.append(view[offset:stop].cast(typecode))
+            offset = stop
+        word_offsets, word_weights, keys, indptr, weights, targets = sections
+        return cls(
+            order, view[offset:offset + blob_size], word_offsets,
+            word_weights, keys, indptr, targets, weights, buffer
+        )
+
+    def word(self, word_id):
+        start, stop = self.word_offsets[word_id:word_id + 2]
+        return bytes(self.blob[start:stop]).decode()
+
+    def sample_word(self, rng):
+        total = self.word_weights[-1]
+        return bisect_right(self.word_weights, rng.random() * total)
+
+    def sample_next(self, key, rng):
+        row = bisect_left(self.keys, key)
+        if row == len(self.keys) or self.keys[row] != key:
+            return self.sample_word(rng)
+        start, stop = self.indptr[row], self.indptr[row + 1]
+        total = self.weights[stop - 1]
+        return self.targets[
+            bisect_right(self.weights, rng.random() * total, start, stop)
+        ]
+
+    def generate_ids(self, n, rng=random):
+        result = [self.sample_word(rng) for _ in range(self.order)]
+        key = self.encode_state(result, self.n_words)
+        modulus = self.n_words ** self.order
+        while len(result) < n:
+            word_id = self.sample_next(key, rng)
+            result.append(word_id)
+            key = (key * self.n_words + word_id) % modulus
+        return result
+
+    def generate(self, n, rng=random):
+        return " ".join(map(self.word, self.generate_ids(n, rng)))
+
+    def global_weights(self):
+        # Cumulative weights running over all rows, so that a single
+        # ``searchsorted`` samples the next word for every text at once.
+        if self.global_cumweights is None:
+            weights = np.frombuffer(self.weights, dtype=np.uint64)
+            starts = np.frombuffer(self.indptr, dtype=np.uint64)[:-1]
+            counts = np.diff(weights, prepend=np.uint64(0))
+            counts[starts.astype(np.intp)] = weights[starts.astype(np.intp)]
+            self.global_cumweights = np.cumsum(counts, dtype=np.float64)
+        return self.global_cumweights
+
+    def iter_batch_ids(self, k, n, seed=None):
+        if np is None:
+            rng = random.Random(seed)
+            yield from zip(*(self.generate_ids(n, rng) for _ in range(k)))
+            return
+
+        rng = np.random.default_rng(seed)
+        word_weights = np.frombuffer(self.word_weights, dtype=np.uint64)
+        keys = np.frombuffer(self.keys, dtype=np.uint64)
+        indptr = np.frombuffer(self.indptr, dtype=np.uint64).astype(np.intp)
+        targets = np.frombuffer(self.targets, dtype=np.uint32)
+        cumweights = self.global_weights()
+        n_words = np.uint64(self.n_words)
+        modulus = np.uint64(self.n_words ** (self.order - 1))
+
+        def sample_words(size):
+            return np.searchsorted(
+                word_weights, rng.random(size) * float(word_weights[-1]),
+                side="right"
+            ).astype(np.uint64)
+
+        def sample_next(state):
+            if not len(keys):
+                # Too short a corpus to have a single transition.
+                return sample_words(k)
+            rows = np.minimum(np.searchsorted(keys, state), len(keys) - 1)
+            found = keys[rows] == state
+            start, stop = indptr[rows], indptr[rows + 1]
+            base = np.where(start > 0, cumweights[start - 1], 0.0)
+            offsets = rng.random(k) * (cumweights[stop - 1] - base)
+            picked = np.searchsorted(cumweights, base + offsets, side="right")
+            return np.where(
+                found,
+                targets[np.minimum(picked, stop - 1)],
+                sample_words(k)
+            ).astype(np.uint64)
+
+        state = np.zeros(k, dtype=np.uint64)
+        for i in range(n):
+            if i < self.order:
+                word_ids = sample_words(k)
+            else:
+                word_ids = sample_next(state)
+            state = state % modulus * n_words + word_ids
+            yield word_ids
+
+    def iter_batch(self, k, n, seed=None):
+        for word_ids in self.iter_batch_ids(k, n, seed):
+            yield [self.word(int(word_id)) for word_id in word_ids]
+
+    def generate_batch(self, k, n, seed=None):
+        return [" ".join(text) for text in zip(*self.iter_batch(k, n, seed))]
+
+
+def snoop_says(filename, n, order=2, model_path=None):
+    # The saved model is reused only if it was built for the same order
+    # and after the last change to the corpus.
+    if model_path is not None and os.path.exists(model_path) and (
+        os.path.getmtime(model_path) >= os.path.getmtime(filename)
+    ):
+        model = MarkovModel.load(model_path)
+        if model.order == order:
+            return model.generate(n)
+    model = MarkovModel.from_file(filename, order)
+    if model_path is not None:
+        model.save(model_path)
+    return model.generate(n)
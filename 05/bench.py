@@ -0,0 +1,46 @@
+import random
+import string
+import sys
+import time
+
+import task
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+def generate_words(n, typos=3, seed=0):
+    rng = random.Random(seed)
+    result = []
+    while len(result) < n:
+        word = "".join(
+            rng.choices(string.ascii_lowercase, k=rng.randrange(5, 12))
+        )
+        for _ in range(typos):
+            chars = list(word)
+            chars[rng.randrange(len(chars))] = rng.choice(
+                string.ascii_lowercase
+            )
+            result.append("".join(chars))
+    return result[:n]
+
+
+def bench_insert(sizes, mismatch_percent=20):
+    for n in sizes or [1000, 10000, 100000]:
+        words = generate_words(n)
+        corrector = task.TypoCorrector(mismatch_percent)
+        elapsed, _ = timed(corrector.extend, words)
+        rebuild, _ = timed(task.correct_typos, words, mismatch_percent)
+        print(f"{n:>7} words: {n / elapsed:10.0f} inserts/s, "
+              f"full rebuild {rebuild:.3f}s")
+
+
+BENCHMARKS = {"insert": bench_insert}
+
+
+if __name__ == "__main__":
+    _, name, *sizes = sys.argv
+    BENCHMARKS[name]([int(size) for size in sizes])
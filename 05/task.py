@@ -1,7 +1,23 @@
+import asyncio
+import atexit
 import functools
+import inspect
+import io
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from array import array
 from collections import Counter, defaultdict, namedtuple, OrderedDict
+from concurrent.futures import Future
 from itertools import combinations
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 Factor = namedtuple("Factor", ["elements", "levels"])
 
@@ -29,41 +45,320 @@ def invert(dictionary):
 
 
 CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
-
-
-def lru_cache(func=None, *, maxsize=64):
+TieredCacheInfo = namedtuple(
+    "TieredCacheInfo", CacheInfo._fields + ("disk_hits", "disk_misses")
+)
+
+
+KWD_MARK = object()
+MISSING = object()
+
+
+def make_key(args, kwargs):
+    # Positional-only calls use the args tuple itself, the marker keeps
+    # keyword calls from colliding with it.
+    if not kwargs:
+        return args
+    return KWD_MARK, args, frozenset(kwargs.items())
+
+
+def canonical(value):
+    # Keys that compare equal must encode to the same bytes. In a dict 1,
+    # 1.0 and True are one key, and a frozenset has no stable order.
+    if isinstance(value, bool) or (
+        isinstance(value, float) and value.is_integer()
+    ):
+        return int(value)
+    if isinstance(value, tuple):
+        return tuple(map(canonical, value))
+    if isinstance(value, frozenset):
+        # Keys are hashable, so a list can only come from here.
+        return sorted(map(canonical, value), key=dumps_key)
+    return value
+
+
+def dumps_key(key):
+    # Without the memo, pickle doesn't encode whether equal parts of the key
+    # are also the same object.
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer)
+    pickler.fast = True
+    pickler.dump(canonical(key))
+    return buffer.getvalue()
+
+
+class SqliteStore:
+    def __init__(self, path, dumps=pickle.dumps, loads=pickle.loads,
+                 dumps_key=dumps_key):
+        self.dumps, self.loads = dumps, loads
+        self.dumps_key = dumps_key
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (namespace TEXT, key BLOB, "
+            "value BLOB, PRIMARY KEY (namespace, key))"
+        )
+
+    def get(self, namespace, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ?",
+                (namespace, self.dumps_key(key))
+            ).fetchone()
+        return MISSING if row is None else self.loads(row[0])
+
+    def put(self, namespace, items):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                [
+                    (namespace, self.dumps_key(key), self.dumps(value))
+                    for key, value in items
+                ]
+            )
+
+    def clear(self, namespace):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM cache WHERE namespace = ?", (namespace,)
+            )
+
+
+def disk_key(key):
+    # Memory keys hold kwargs in a frozenset, which is neither stable across
+    # processes nor free of the in-process marker.
+    if key and key[0] is KWD_MARK:
+        _, args, kwargs = key
+        return args, tuple(sorted(kwargs))
+    return key, ()
+
+
+def lru_cache(func=None, *, maxsize=64, store=None, write_back=False):
     if func is None:
-        return functools.partial(lru_cache, maxsize=maxsize)
+        return functools.partial(
+            lru_cache, maxsize=maxsize, store=store, write_back=write_back
+        )
 
     cache = OrderedDict()
     hits, misses = 0, 0
+    disk_hits, disk_misses = 0, 0
+    namespace = f"{func.__module__}.{func.__qualname__}"
 
-    @functools.wraps(func)
-    def inner(*args, **kwargs):
-        key = (args, frozenset(kwargs.items()))
-        if key in cache:
-            nonlocal hits
-            hits += 1
-            cache.move_to_end(key)
+    def remember(key, value):
+        cache[key] = value
+        if len(cache) > maxsize:
+            evicted = cache.popitem(last=False)
+            if store is not None and write_back:
+                evicted_key, evicted_value = evicted
+                store.put(namespace, [(disk_key(evicted_key), evicted_value)])
+
+    def recall(key):
+        nonlocal disk_hits, disk_misses
+        if store is None:
+            return MISSING
+        result = store.get(namespace, disk_key(key))
+        if result is MISSING:
+            disk_misses += 1
         else:
-            nonlocal misses
+            disk_hits += 1
+        return result
+
+    if inspect.iscoroutinefunction(func):
+        assert store is None, "results of coroutines can't be persisted"
+
+        def forget(key, task):
+            failed = task.cancelled() or task.exception() is not None
+            if failed and cache.get(key) is task:
+                del cache[key]
+
+        @functools.wraps(func)
+        async def inner(*args, **kwargs):
+            nonlocal hits, misses
+            key = make_key(args, kwargs)
+            task = cache.get(key)
+            if task is not None:
+                hits += 1
+                cache.move_to_end(key)
+            else:
+                misses += 1
+                task = asyncio.ensure_future(func(*args, **kwargs))
+                task.add_done_callback(functools.partial(forget, key))
+                remember(key, task)
+            # All the concurrent awaiters share one task, cancelling one of
+            # them must not cancel it for the rest.
+            return await asyncio.shield(task)
+    else:
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            nonlocal hits, misses
+            key = args if not kwargs else make_key(args, kwargs)
+            result = cache.get(key, MISSING)
+            if result is not MISSING:
+                hits += 1
+                cache.move_to_end(key)
+                return result
+
             misses += 1
-            cache[key] = func(*args, **kwargs)
+            result = recall(key)
+            if result is MISSING:
+                result = func(*args, **kwargs)
+                if store is not None and not write_back:
+                    store.put(namespace, [(disk_key(key), result)])
+            remember(key, result)
+            return result
 
-        result = cache[key]
+    def clear():
+        nonlocal hits, misses, disk_hits, disk_misses
+        hits, misses = 0, 0
+        disk_hits, disk_misses = 0, 0
+        cache.clear()
 
-        if len(cache) > maxsize:
-            cache.popitem(last=False)
+    def purge():
+        # The disk tier may be shared with other processes, so it is only
+        # emptied on request, never by cache_clear.
+        if store is not None:
+            store.clear(namespace)
+
+    def flush():
+        if store is not None and write_back:
+            items = [(disk_key(key), value) for key, value in cache.items()]
+            store.put(namespace, items)
+
+    # Entries still in memory are the most recently used, write them back
+    # on exit as well.
+    if store is not None and write_back:
+        atexit.register(flush)
+
+    def info():
+        if store is None:
+            return CacheInfo(hits, misses, maxsize, len(cache))
+        return TieredCacheInfo(
+            hits, misses, maxsize, len(cache), disk_hits, disk_misses
+        )
 
+    inner.cache_clear = clear
+    inner.cache_purge = purge
+    inner.cache_flush = flush
+    inner.cache_info = info
+
+    return inner
+
+
+class CacheShard:
+    def __init__(self, maxsize, maxbytes):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.clear()
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+        self.hits, self.misses = 0, 0
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] <= time.monotonic():
+            self.discard(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return True, entry[0]
+
+    def store(self, key, value, size, ttl):
+        self.discard(key)
+        expires = float("inf") if ttl is None else time.monotonic() + ttl
+        self.entries[key] = value, expires, size
+        self.nbytes += size
+        while self.entries and (
+            len(self.entries) > self.maxsize
+            or self.maxbytes is not None and self.nbytes > self.maxbytes
+        ):
+            _, (_, _, evicted_size) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_size
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+
+
+def sharded_lru_cache(func=None, *, maxsize=64, shards=8, ttl=None,
+                      maxbytes=None, sizeof=sys.getsizeof):
+    if func is None:
+        return functools.partial(
+            sharded_lru_cache, maxsize=maxsize, shards=shards, ttl=ttl,
+            maxbytes=maxbytes, sizeof=sizeof
+        )
+
+    # Every shard is an independent LRU with its share of the limits, so
+    # eviction order is only approximately global. The shares add up to
+    # exactly the limits.
+    def share(limit, i):
+        return limit // shards + (i < limit % shards)
+
+    segments = [
+        CacheShard(
+            share(maxsize, i),
+            None if maxbytes is None else share(maxbytes, i)
+        )
+        for i in range(shards)
+    ]
+
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        key = make_key(args, kwargs)
+        shard = segments[hash(key) % shards]
+        with shard.lock:
+            found, result = shard.lookup(key)
+            if found:
+                return result
+            future = shard.inflight.get(key)
+            if future is None:
+                future = shard.inflight[key] = Future()
+                leader = True
+            else:
+                leader = False
+
+        # Concurrent misses for the same key wait for the first one.
+        if not leader:
+            return future.result()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            with shard.lock:
+                del shard.inflight[key]
+            future.set_exception(e)
+            raise
+        with shard.lock:
+            del shard.inflight[key]
+            shard.store(key, result, sizeof(result), ttl)
+        future.set_result(result)
         return result
 
     def clear():
-        nonlocal hits, misses
-        hits, misses = 0, 0
-        cache.clear()
+        for shard in segments:
+            with shard.lock:
+                shard.clear()
+
+    def info():
+        hits = misses = currsize = 0
+        for shard in segments:
+            with shard.lock:
+                hits += shard.hits
+                misses += shard.misses
+                currsize += len(shard.entries)
+        return CacheInfo(hits, misses, maxsize, currsize)
 
     inner.cache_clear = clear
-    inner.cache_info = lambda: CacheInfo(hits, misses, maxsize, len(cache))
+    inner.cache_info = info
 
     return inner
 
@@ -75,7 +370,54 @@ def hamming(seq1, seq2):
     return sum(ch1 != ch2 for ch1, ch2 in zip(seq1, seq2))
 
 
-def build_graph(words, mismatch_percent):
+def segments(length, n):
+    bounds = [length * s // n for s in range(n + 1)]
+    return list(zip(bounds, bounds[1:]))
+
+
+def candidate_pairs(words, bucket, max_mismatches):
+    # Pigeonhole: words with at most d mismatches agree exactly on one of
+    # d + 1 segments.
+    length = len(words[bucket[0]])
+    candidates = set()
+    for start, stop in segments(length, max_mismatches + 1):
+        index = group_by(bucket, lambda i: words[i][start:stop])
+        for same in index.values():
+            candidates.update(combinations(same, 2))
+    return candidates
+
+
+def similar(words, bucket, pairs, mismatch_percent, chunk_size=2 ** 16):
+    if np is None:
+        return [
+            (idx1, idx2) for idx1, idx2 in pairs
+            if hamming(words[idx1], words[idx2]) * 100
+            <= mismatch_percent * len(words[idx1])
+        ]
+
+    # Words of the bucket become rows of a code point matrix, so that a chunk
+    # of candidate pairs is checked with a single comparison.
+    length = len(words[bucket[0]])
+    codes = np.frombuffer(
+        "".join(words[i] for i in bucket).encode("utf-32-le"), dtype=np.uint32
+    ).reshape(len(bucket), length)
+    rows = {idx: row for row, idx in enumerate(bucket)}
+    pairs = list(pairs)
+    result = []
+    for start in range(0, len(pairs), chunk_size):
+        chunk = pairs[start:start + chunk_size]
+        first, second = np.array(
+            [(rows[idx1], rows[idx2]) for idx1, idx2 in chunk], dtype=np.intp
+        ).reshape(-1, 2).T
+        mismatches = (codes[first] != codes[second]).sum(axis=1)
+        keep = mismatches * 100 <= mismatch_percent * length
+        result.extend(pair for pair, ok in zip(chunk, keep.tolist()) if ok)
+    return result
+
+
+def build_graph(words, mismatch_percent, indexed=False):
+    if indexed:
+        return build_graph_indexed(words, mismatch_percent)
     result = {i: [] for i in range(len(words))}
     for (idx1, word1), (idx2, word2) in combinations(enumerate(words), 2):
         if len(word1) != len(word2):
@@ -86,6 +428,108 @@ def build_graph(words, mismatch_percent):
     return result
 
 
+def iter_edges(words, mismatch_percent):
+    by_length = group_by(range(len(words)), lambda i: len(words[i]))
+    for length, bucket in by_length.items():
+        max_mismatches = int(mismatch_percent * length // 100)
+        if max_mismatches >= length:
+            yield from combinations(bucket, 2)
+        else:
+            candidates = candidate_pairs(words, bucket, max_mismatches)
+            yield from similar(words, bucket, candidates, mismatch_percent)
+
+
+def build_graph_indexed(words, mismatch_percent):
+    # Sorted edges reproduce the neighbour order of the exhaustive scan.
+    result = {i: [] for i in range(len(words))}
+    for idx1, idx2 in sorted(iter_edges(words, mismatch_percent)):
+        result[idx1].append(idx2)
+        result[idx2].append(idx1)
+    return result
+
+
+class CSRGraph:
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    @classmethod
+    def from_edges(cls, n, edges):
+        edges = sorted(edges)
+        indptr = array("q", bytes(8 * (n + 1)))
+        for idx1, idx2 in edges:
+            indptr[idx1 + 1] += 1
+            indptr[idx2 + 1] += 1
+        for i in range(n):
+            indptr[i + 1] += indptr[i]
+
+        indices = array("q", bytes(8 * indptr[n]))
+        fill = indptr[:-1]
+        for idx1, idx2 in edges:
+            indices[fill[idx1]] = idx2
+            indices[fill[idx2]] = idx1
+            fill[idx1] += 1
+            fill[idx2] += 1
+        return cls(indptr, indices)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, vertex):
+        return self.indices[self.indptr[vertex]:self.indptr[vertex + 1]]
+
+    def items(self):
+        return ((vertex, self[vertex]) for vertex in range(len(self)))
+
+    def to_adj_list(self):
+        return {vertex: list(adj) for vertex, adj in self.items()}
+
+
+def build_csr_graph(words, mismatch_percent):
+    return CSRGraph.from_edges(
+        len(words), iter_edges(words, mismatch_percent)
+    )
+
+
+class DisjointSet:
+    def __init__(self, n):
+        self.parent = array("q", range(n))
+        self.rank = bytearray(n)
+
+    def add(self):
+        self.parent.append(len(self.parent))
+        self.rank.append(0)
+        return len(self.parent) - 1
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x == y:
+            return x
+        if self.rank[x] < self.rank[y]:
+            x, y = y, x
+        self.parent[y] = x
+        if self.rank[x] == self.rank[y]:
+            self.rank[x] += 1
+        return x
+
+    def update(self, edges):
+        for x, y in edges:
+            self.union(x, y)
+
+    def components(self):
+        result = {}
+        for vertex in range(len(self.parent)):
+            result.setdefault(self.find(vertex), set()).add(vertex)
+        return list(result.values())
+
+
 def export_graph(adj_list, labels):
     graph = ["graph {"]
     for vertex, adj_vertices in adj_list.items():
@@ -114,11 +558,16 @@ def find_connected_components(adj_list):
     return result
 
 
+VECTORIZE_MIN_WORDS = 64
+
+
 def find_consensus(words):
     assert words, "List are empty"
     assert all(len(word) == len(words[0]) for word in words), (
         f"Words are of unequal lengths"
     )
+    if np is not None and len(words) >= VECTORIZE_MIN_WORDS:
+        return find_consensus_vectorized(words)
     result = []
     for chars in zip(*words):
         most_common_char, _ = Counter(chars).most_common(1)[0]
@@ -126,12 +575,165 @@ def find_consensus(words):
     return "".join(result)
 
 
+def find_consensus_vectorized(words, max_span=2 ** 16):
+    length = len(words[0])
+    if not length:
+        return ""
+    codes = np.frombuffer(
+        "".join(words).encode("utf-32-le"), dtype=np.uint32
+    ).reshape(len(words), length)
+    alphabet = None
+    if int(codes.max()) - int(codes.min()) >= max_span:
+        alphabet, codes = np.unique(codes, return_inverse=True)
+        codes = codes.reshape(len(words), length)
+    low = int(codes.min())
+    span = int(codes.max()) - low + 1
+    counts = np.bincount(
+        (codes - low + np.arange(length) * span).ravel(),
+        minlength=length * span
+    ).reshape(length, span)
+
+    best = counts.argmax(axis=1)
+    top = counts[np.arange(length), best]
+    # ``Counter.most_common`` resolves ties in favour of the character seen
+    # first, so tied columns look up the first word holding any of them.
+    tied_columns = np.flatnonzero((counts == top[:, None]).sum(axis=1) > 1)
+    for column in tied_columns.tolist():
+        tied = np.flatnonzero(counts[column] == top[column]) + low
+        first = np.isin(codes[:, column], tied).argmax()
+        best[column] = codes[first, column] - low
+
+    best += low
+    if alphabet is not None:
+        best = alphabet[best]
+    return "".join(map(chr, best.tolist()))
+
+
+class ColumnCounts:
+    # Ties go to the character of the word with the lowest index, as in
+    # ``find_consensus`` over words in index order, however the counts were
+    # merged.
+    def __init__(self, length):
+        self.columns = [Counter() for _ in range(length)]
+        self.first_seen = [{} for _ in range(length)]
+        self.n_words = 0
+
+    def add(self, word, index=None):
+        assert len(word) == len(self.columns), (
+            f"Words are of unequal lengths"
+        )
+        if index is None:
+            index = self.n_words
+        self.n_words += 1
+        for column, first_seen, char in zip(
+            self.columns, self.first_seen, word
+        ):
+            column[char] += 1
+            first_seen[char] = min(first_seen.get(char, index), index)
+
+    def merge(self, other):
+        self.n_words += other.n_words
+        for column, other_column in zip(self.columns, other.columns):
+            column.update(other_column)
+        for first_seen, other_first_seen in zip(
+            self.first_seen, other.first_seen
+        ):
+            for char, index in other_first_seen.items():
+                first_seen[char] = min(first_seen.get(char, index), index)
+
+    def consensus(self):
+        return "".join(
+            min(column, key=lambda char: (-column[char], first_seen[char]))
+            for column, first_seen in zip(self.columns, self.first_seen)
+        )
+
+
+def find_consensus_stream(words):
+    counts = None
+    for word in words:
+        if counts is None:
+            counts = ColumnCounts(len(word))
+        counts.add(word)
+    assert counts is not None, "List are empty"
+    return counts.consensus()
+
+
 def correct_typos(words, mismatch_percent):
     result = [None] * len(words)
-    graph = build_graph(words, mismatch_percent)
-    connected_components = find_connected_components(graph)
-    for component in connected_components:
+    # Edges go straight into the disjoint set, the graph is never built.
+    components = DisjointSet(len(words))
+    components.update(iter_edges(words, mismatch_percent))
+    for component in components.components():
+        # Index order decides ties, the same way TypoCorrector does.
+        component = sorted(component)
         consensus = find_consensus([words[i] for i in component])
         for i in component:
             result[i] = consensus
     return result
+
+
+class TypoCorrector:
+    def __init__(self, mismatch_percent, words=()):
+        self.mismatch_percent = mismatch_percent
+        self.words = []
+        self.index = defaultdict(list)
+        self.components = DisjointSet(0)
+        self.counts = {}
+        self.consensus = {}
+        self.extend(words)
+
+    def index_keys(self, word):
+        length = len(word)
+        max_mismatches = int(self.mismatch_percent * length // 100)
+        if max_mismatches >= length:
+            return [(length, None)]
+        return [
+            (length, start, word[start:stop])
+            for start, stop in segments(length, max_mismatches + 1)
+        ]
+
+    def neighbours(self, word, keys):
+        candidates = set()
+        for key in keys:
+            candidates.update(self.index.get(key, ()))
+        return [
+            idx for idx in candidates
+            if hamming(word, self.words[idx]) * 100
+            <= self.mismatch_percent * len(word)
+        ]
+
+    def insert(self, word):
+        idx = self.components.add()
+        self.words.append(word)
+        self.counts[idx] = ColumnCounts(len(word))
+        self.counts[idx].add(word, idx)
+        keys = self.index_keys(word)
+        for neighbour in self.neighbours(word, keys):
+            self.join(idx, neighbour)
+        for key in keys:
+            self.index[key].append(idx)
+        return idx
+
+    def join(self, idx1, idx2):
+        root1 = self.components.find(idx1)
+        root2 = self.components.find(idx2)
+        if root1 == root2:
+            return
+        root = self.components.union(root1, root2)
+        absorbed = root2 if root == root1 else root1
+        self.counts[root].merge(self.counts.pop(absorbed))
+        self.consensus.pop(root1, None)
+        self.consensus.pop(root2, None)
+
+    def extend(self, words):
+        for word in words:
+            self.insert(word)
+
+    def correct(self, idx):
+        root = self.components.find(idx)
+        if root not in self.consensus:
+            self.consensus[root] = self.counts[root].consensus()
+        return self.consensus[root]
+
+    def corrections(self):
+        return [self.correct(idx) for idx in range(len(self.words))]
@@ -0,0 +1,125 @@
+import random
+import sys
+import time
+
+import numpy as np
+
+from task import (
+    C, V, Fraction, Product, Sum, newton_raphson, newton_raphson_batch
+)
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return time.perf_counter() - start, result
+
+
+def random_expr(n_nodes, rng):
+    if n_nodes <= 1:
+        return rng.choice([V("x"), V("y"), C(rng.uniform(0.5, 1.5))])
+    op = rng.choice([Sum, Product, Fraction])
+    left = rng.randrange(1, n_nodes)
+    lhs = random_expr(left, rng)
+    rhs = random_expr(n_nodes - left, rng)
+    if op is Fraction:
+        rhs = C(2) + rhs * rhs
+    return op(lhs, rhs)
+
+
+def bench_compile(sizes, n_points=1000):
+    rng = random.Random(0)
+    points = [(rng.random(), rng.random()) for _ in range(n_points)]
+    for size in sizes or [10, 100, 1000]:
+        expr = random_expr(size, rng)
+        walked, _ = timed(lambda: [expr(x=x, y=y) for x, y in points])
+        compiling, f = timed(expr.compile, "x", "y")
+        compiled, _ = timed(lambda: [f(x, y) for x, y in points])
+        print(f"{size:>5} nodes: tree walk {walked:.4f}s, "
+              f"compile {compiling:.4f}s, compiled {compiled:.4f}s "
+              f"({walked / compiled:.0f}x)")
+
+
+def bench_batch(sizes, n_points=100000):
+    rng = random.Random(0)
+    xs, ys = np.random.default_rng(0).random((2, n_points))
+    for size in sizes or [10, 100, 1000]:
+        expr = random_expr(size, rng)
+        f = expr.compile("x", "y")
+        compiled, expected = timed(
+            lambda: [f(x, y) for x, y in zip(xs.tolist(), ys.tolist())]
+        )
+        batched, result = timed(lambda: expr.evaluate(x=xs, y=ys))
+        assert np.allclose(result, expected)
+        print(f"{size:>5} nodes: compiled {compiled:.4f}s, "
+              f"batched {batched:.4f}s ({compiled / batched:.0f}x)")
+
+
+def tree_size(expr):
+    sizes = {}
+    for node in expr.postorder():
+        sizes[id(node)] = 1 + sum(sizes[id(o)] for o in node.operands())
+    return sizes[id(expr)]
+
+
+def bench_derivatives(orders):
+    x = V("x")
+    expr = x * x * x / (C(1) + x * x)
+    for order in range(1, max(orders or [10]) + 1):
+        elapsed, expr = timed(expr.d, x)
+        print(f"d^{order:<2}: {len(list(expr.postorder())):>6} shared nodes, "
+              f"{tree_size(expr):>14} as a tree, {elapsed:.4f}s")
+
+
+def bench_simplify(sizes, n_points=1000):
+    rng = random.Random(0)
+    points = [(rng.random(), rng.random()) for _ in range(n_points)]
+    x = V("x")
+    for size in sizes or [10, 100, 1000]:
+        expr = random_expr(size, rng).d(x).d(x)
+        simplifying, shrink = timed(expr.shrink)
+        f = expr.compile("x", "y")
+        g = expr.simplify().compile("x", "y")
+        before, _ = timed(lambda: [f(x, y) for x, y in points])
+        after, _ = timed(lambda: [g(x, y) for x, y in points])
+        print(f"{size:>5} nodes: d^2 {shrink.before} -> {shrink.after} nodes "
+              f"({shrink.ratio:.1f}x) in {simplifying:.4f}s, "
+              f"compiled {before:.4f}s -> {after:.4f}s")
+
+    # Array constants are opaque to the rewrite rules, but the simplified
+    # expression must still agree with the original.
+    roots = C(np.array([2.0, 3.0]))
+    xs = np.array([0.5, 1.5])
+    for expr in [x * x - roots, (x * x - roots).d(x), x * roots / roots]:
+        assert np.allclose(expr.simplify().evaluate(x=xs), expr.evaluate(x=xs))
+
+
+def bench_newton(sizes):
+    x = V("x")
+    expr = (x + C(-1)) ** C(3) + x
+    for size in sizes or [10, 1000, 100000]:
+        x_0 = np.random.default_rng(0).uniform(-10, 10, size)
+        looped, expected = timed(
+            lambda: [newton_raphson(expr, x, threshold=1e-10)
+                     for x in x_0.tolist()]
+        )
+        batched, roots = timed(
+            lambda: newton_raphson_batch(expr, x_0, threshold=1e-10)
+        )
+        assert np.allclose(roots, expected)
+        print(f"{size:>7} starting points: loop {looped:.4f}s, "
+              f"batch {batched:.4f}s ({looped / batched:.0f}x)")
+
+
+BENCHMARKS = {
+    "compile": bench_compile,
+    "batch": bench_batch,
+    "derivatives": bench_derivatives,
+    "simplify": bench_simplify,
+    "newton": bench_newton,
+}
+
+
+if __name__ == "__main__":
+    _, name, *sizes = sys.argv
+    BENCHMARKS[name]([int(size) for size in sizes])
@@ -1,3 +1,16 @@
+import numbers
+import operator
+import weakref
+from collections import namedtuple
+from functools import reduce
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
 def peel(cls):
     return {attr for attr in dir(cls) if not attr.startswith("_")}
 
@@ -11,13 +24,144 @@ def implements(interface):
     return inner
 
 
+Shrink = namedtuple("Shrink", ["before", "after", "ratio"])
+
+
 class Expr():
+    # Nodes are hash-consed: constructing an expression structurally equal
+    # to a live one returns that same object, so identity is equality and
+    # an expression is a DAG rather than a tree.
+    __slots__ = (
+        "structural_hash", "sort_key", "derivatives", "simplest",
+        "compiled", "__weakref__"
+    )
+    interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, *args):
+        key = cls.intern_key(*args)
+        node = None if key is None else Expr.interned.get(key)
+        if node is None:
+            node = super().__new__(cls)
+            node.derivatives = {}
+            node.simplest = None
+            node.compiled = {}
+            node.init(*args)
+            if key is not None:
+                Expr.interned[key] = node
+        return node
+
+    def __hash__(self):
+        return self.structural_hash
+
+    def __reduce__(self):
+        # Only the constructor arguments, the caches stay behind.
+        return self.__class__, self.__getnewargs__()
+
     def __call__(self, **env):
         pass
 
     def d(self, wrt):
+        derivative = self.derivatives.get(wrt)
+        if derivative is None:
+            derivative = self.derivatives[wrt] = self.derive(wrt)
+        return derivative
+
+    def derive(self, wrt):
         pass
 
+    def postorder(self):
+        # Explicit stack, so that deep expressions don't hit the recursion
+        # limit. Shared subexpressions are visited once.
+        seen, stack = set(), [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in seen:
+                continue
+            operands = node.operands()
+            if operands and not expanded:
+                stack.append((node, True))
+                stack.extend((operand, False) for operand in operands[::-1])
+                continue
+            seen.add(id(node))
+            yield node
+
+    def compile(self, *variables):
+        variables = tuple(getattr(v, "variable", v) for v in variables)
+        compiled = self.compiled.get(variables)
+        if compiled is None:
+            compiled = self.compiled[variables] = self.lower_all(variables)
+        return compiled
+
+    def lower_all(self, variables):
+        args = {variable: f"a{i}" for i, variable in enumerate(variables)}
+        namespace, lines, temps = {}, [], {}
+        for node in self.postorder():
+            source = node.lower(
+                [temps[id(operand)] for operand in node.operands()],
+                args, namespace
+            )
+            temps[id(node)] = f"t{len(lines)}"
+            lines.append(f"    t{len(lines)} = {source}")
+
+        source = "def compiled({}):\n{}\n    return {}".format(
+            ", ".join(args.values()), "\n".join(lines), temps[id(self)]
+        )
+        exec(source, namespace)
+        return namespace["compiled"]
+
+    def evaluate(self, **env):
+        env = {variable: np.asarray(value) for variable, value in env.items()}
+        values = {}
+        for node in self.postorder():
+            values[id(node)] = node.apply(
+                [values[id(operand)] for operand in node.operands()], env
+            )
+        return values[id(self)]
+
+    is_scalar = False
+
+    def operands(self):
+        return ()
+
+    def size(self):
+        return sum(1 for _ in self.postorder())
+
+    def simplify(self):
+        # Every pass rewrites the nodes bottom-up, the operands of a node
+        # being simplified before the node itself. The result of a rewrite is
+        # cached on the node, so each node is rewritten at most once.
+        expr = self
+        while True:
+            for node in expr.postorder():
+                if node.simplest is None:
+                    node.simplest = node.rewrite(
+                        *[operand.simplest for operand in node.operands()]
+                    )
+            if expr.simplest is expr:
+                break
+            expr = expr.simplest
+        self.simplest = expr
+        return expr
+
+    def shrink(self):
+        before, after = self.size(), self.simplify().size()
+        return Shrink(before, after, before / after)
+
+    def rewrite(self):
+        return self
+
+    def terms(self):
+        return [self]
+
+    def factors(self):
+        return [self]
+
+    def coefficient(self):
+        return 1, self
+
+    def exponent(self):
+        return self, 1
+
     @property
     def simplified(self):
         return self
@@ -45,14 +189,54 @@ class Expr():
 
 
 class Const(Expr):
-    def __init__(self, value):
+    __slots__ = ("value", "is_scalar")
+    is_constexpr = True
+
+    @classmethod
+    def intern_key(cls, value):
+        # The type keeps 1, 1.0 and True apart. Unhashable values, e.g.
+        # arrays, aren't interned at all: each Const of one is a new node.
+        try:
+            hash(value)
+        except TypeError:
+            return None
+        if isinstance(value, numbers.Number) and not isinstance(
+            value, numbers.Integral
+        ):
+            # -0.0 == 0.0 but 1 / -0.0 is -inf, repr tells them apart.
+            return cls, type(value), value, repr(value)
+        return cls, type(value), value
+
+    def init(self, value):
         self.value = value
+        # The simplifier only folds and rewrites scalars, an array constant
+        # is an opaque operand to it.
+        self.is_scalar = isinstance(value, numbers.Number)
+        key = self.intern_key(value)
+        self.structural_hash = hash(key if key is not None else id(value))
+        self.sort_key = (0, repr(value))
+
+    def __getnewargs__(self):
+        return self.value,
+
+    def derive(self, wrt):
+        return Const(0)
+
+    def coefficient(self):
+        if self.is_scalar:
+            return self.value, None
+        return 1, self
 
     def __call__(self, **env):
         return self.value
 
-    def d(self, wrt):
-        return Const(0)
+    def apply(self, operands, env):
+        return self.value
+
+    def lower(self, operands, args, namespace):
+        name = f"c{len(namespace)}"
+        namespace[name] = self.value
+        return name
 
     def __repr__(self):
         return f"Const({self.value})"
@@ -60,20 +244,34 @@ class Const(Expr):
     def __str__(self):
         return str(self.value)
 
-    @property
-    def is_constexpr(self):
-        return True
-
 
 class Var(Expr):
-    def __init__(self, variable):
+    __slots__ = ("variable",)
+    is_constexpr = False
+
+    @classmethod
+    def intern_key(cls, variable):
+        return cls, variable
+
+    def init(self, variable):
         self.variable = variable
+        self.structural_hash = hash(self.intern_key(variable))
+        self.sort_key = (1, str(variable))
+
+    def __getnewargs__(self):
+        return self.variable,
+
+    def derive(self, wrt):
+        return Const(int(self.variable == wrt.variable))
 
     def __call__(self, **env):
         return env[self.variable]
 
-    def d(self, wrt):
-        return Const(int(self.variable == wrt.variable))
+    def apply(self, operands, env):
+        return env[self.variable]
+
+    def lower(self, operands, args, namespace):
+        return args[self.variable]
 
     def __repr__(self):
         return f"Var({self.variable!r})"
@@ -81,19 +279,66 @@ class Var(Expr):
     def __str__(self):
         return str(self.variable)
 
-    @property
-    def is_constexpr(self):
-        return False
-
 
 C = Const
 V = Var
 
 
 class BinOp(Expr):
-    def __init__(self, lhs, rhs):
+    __slots__ = ("lhs", "rhs", "is_constexpr")
+
+    @classmethod
+    def intern_key(cls, lhs, rhs):
+        # Operands are interned already, and the node keeps them alive for
+        # as long as its key is in the table, so their ids are stable.
+        return cls, id(lhs), id(rhs)
+
+    def init(self, lhs, rhs):
         self.lhs = lhs
         self.rhs = rhs
+        self.is_constexpr = lhs.is_constexpr and rhs.is_constexpr
+        self.structural_hash = hash(
+            (self.__class__, lhs.structural_hash, rhs.structural_hash)
+        )
+        # Shared operands share their keys, and tuple comparison checks
+        # identity first, so comparing keys doesn't expand the DAG.
+        self.sort_key = (2, self.sign, lhs.sort_key, rhs.sort_key)
+
+    def __getnewargs__(self):
+        return self.lhs, self.rhs
+
+    def operands(self):
+        return self.lhs, self.rhs
+
+    def apply(self, operands, env):
+        return self.ufunc(*operands)
+
+    def lower(self, operands, args, namespace):
+        lhs, rhs = operands
+        return f"{lhs} {self.sign} {rhs}"
+
+    def rewrite(self, lhs, rhs):
+        if lhs.is_scalar and rhs.is_scalar:
+            try:
+                return Const(self.op(lhs.value, rhs.value))
+            except ArithmeticError:
+                pass
+        return self.rewrite_operands(lhs, rhs)
+
+    def rewrite_operands(self, lhs, rhs):
+        return self.__class__(lhs, rhs)
+
+    def flatten(self):
+        # Sums and products are chains of binary nodes, the n-ary operation
+        # is their list of leaves.
+        leaves, stack = [], [self]
+        while stack:
+            node = stack.pop()
+            if node.__class__ is self.__class__:
+                stack.extend([node.rhs, node.lhs])
+            else:
+                leaves.append(node)
+        return leaves
 
     def __repr__(self):
         return f"{self.__class__.__name__}({self.lhs!r}, {self.rhs!r})"
@@ -101,10 +346,6 @@ class BinOp(Expr):
     def __str__(self):
         return f"({self.sign} {self.lhs} {self.rhs})"
 
-    @property
-    def is_constexpr(self):
-        return self.lhs.is_constexpr and self.rhs.is_constexpr
-
     @property
     def simplified(self):
         if self.is_constexpr:
@@ -113,57 +354,254 @@ class BinOp(Expr):
 
 
 class Sum(BinOp):
+    __slots__ = ()
+    op = staticmethod(operator.add)
+    ufunc = staticmethod(np.add) if np else None
     sign = "+"
 
     def __call__(self, **env):
         return self.lhs(**env) + self.rhs(**env)
 
-    def d(self, wrt):
+    def derive(self, wrt):
         return self.lhs.d(wrt) + self.rhs.d(wrt)
 
+    def terms(self):
+        return self.flatten()
+
+    def rewrite_operands(self, lhs, rhs):
+        # Collects like terms: x + 2 * x + 1 + 3 is rebuilt as 3 * x + 4.
+        constant, coefficients = 0, {}
+        for term in chain(lhs.terms(), rhs.terms()):
+            coefficient, base = term.coefficient()
+            if base is None:
+                constant += coefficient
+            else:
+                coefficients[base] = coefficients.get(base, 0) + coefficient
+
+        terms = [
+            base if coefficient == 1 else Const(coefficient) * base
+            for base, coefficient in sorted(
+                coefficients.items(), key=lambda item: item[0].sort_key
+            )
+            if coefficient != 0
+        ]
+        if constant != 0 or not terms:
+            terms.append(Const(constant))
+        return reduce(Sum, terms)
+
 
 class Product(BinOp):
+    __slots__ = ()
+    op = staticmethod(operator.mul)
+    ufunc = staticmethod(np.multiply) if np else None
     sign = "*"
 
     def __call__(self, **env):
         return self.lhs(**env) * self.rhs(**env)
 
-    def d(self, wrt):
+    def derive(self, wrt):
         return self.lhs.d(wrt) * self.rhs + self.lhs * self.rhs.d(wrt)
 
+    def factors(self):
+        return self.flatten()
+
+    def coefficient(self):
+        if self.lhs.is_scalar:
+            return self.lhs.value, self.rhs
+        return 1, self
+
+    def rewrite_operands(self, lhs, rhs):
+        # Collects like factors: 2 * x * x * 3 is rebuilt as 6 * x ** 2.
+        constant, exponents = 1, {}
+        for factor in chain(lhs.factors(), rhs.factors()):
+            if factor.is_scalar:
+                constant *= factor.value
+                continue
+            base, exponent = factor.exponent()
+            exponents[base] = exponents.get(base, 0) + exponent
+
+        if constant == 0:
+            return Const(constant)
+        factors = [
+            base if exponent == 1 else base ** Const(exponent)
+            for base, exponent in sorted(
+                exponents.items(), key=lambda item: item[0].sort_key
+            )
+            if exponent != 0
+        ]
+        if not factors:
+            return Const(constant)
+        # The constant goes on the left of the whole chain, where
+        # coefficient() looks for it.
+        product = reduce(Product, factors)
+        return product if constant == 1 else Const(constant) * product
+
 
 class Fraction(BinOp):
+    __slots__ = ()
+    op = staticmethod(operator.truediv)
+    ufunc = staticmethod(np.true_divide) if np else None
     sign = "/"
 
     def __call__(self, **env):
         return self.lhs(**env) / self.rhs(**env)
 
-    def d(self, wrt):
+    def derive(self, wrt):
         numerator = self.lhs.d(wrt) * self.rhs - self.lhs * self.rhs.d(wrt)
         denominator = self.rhs * self.rhs
         return numerator / denominator
 
+    def rewrite_operands(self, lhs, rhs):
+        if rhs.is_scalar and rhs.value == 1:
+            return lhs
+        if lhs.is_scalar and lhs.value == 0:
+            return lhs
+        return Fraction(lhs, rhs)
+
 
 class Power(BinOp):
+    __slots__ = ()
+    op = staticmethod(operator.pow)
     sign = "**"
 
+    @staticmethod
+    def ufunc(base, exponent):
+        # Python turns ``int ** negative int`` into a float, NumPy refuses.
+        if np.issubdtype(np.result_type(base), np.integer) and np.any(
+            np.asarray(exponent) < 0
+        ):
+            return np.float_power(base, exponent)
+        return np.power(base, exponent)
+
     def __call__(self, **env):
         return self.lhs(**env) ** self.rhs(**env)
 
-    def d(self, wrt):
+    def derive(self, wrt):
         if self.rhs() == 0:
             return Const(0)
         return self.lhs.d(wrt) * self.rhs * self.lhs ** (self.rhs - Const(1))
 
+    def exponent(self):
+        if self.rhs.is_scalar:
+            return self.lhs, self.rhs.value
+        return self, 1
+
+    def rewrite_operands(self, lhs, rhs):
+        if rhs.is_scalar:
+            if rhs.value == 0:
+                return Const(1)
+            if rhs.value == 1:
+                return lhs
+            # (x ** a) ** b is x ** (a * b) only for integer exponents,
+            # (x ** 2) ** 0.5 is |x|.
+            base, exponent = lhs.exponent()
+            if base is not lhs and all(
+                isinstance(e, int) for e in (exponent, rhs.value)
+            ):
+                return base ** Const(exponent * rhs.value)
+        if lhs.is_scalar and lhs.value == 1:
+            return lhs
+        return Power(lhs, rhs)
+
 
 def newton_raphson(f, x_0, *, threshold):
-    d = f.d(V("x"))
+    d = f.d(V("x")).compile("x")
+    f = f.compile("x")
 
     x_current = x_0
-    x_next = x_current - f(x=x_current) / d(x=x_current)
+    x_next = x_current - f(x_current) / d(x_current)
 
     while abs(x_next - x_current) > threshold:
         x_current = x_next
-        x_next = x_current - f(x=x_current) / d(x=x_current)
+        x_next = x_current - f(x_current) / d(x_current)
 
     return x_next
+
+
+def newton_raphson_batch(f, x_0, *, threshold, max_iter=100, lo=None, hi=None):
+    # Iterates all starting points in lockstep, each lane leaving the batch
+    # once it converges. A lane that knows a sign change of f, either from
+    # the optional [lo, hi] bracket or from two of its own iterates,
+    # bisects whenever a Newton step leaves the bracket or doesn't reduce
+    # |f|. Lanes that fail to converge within max_iter iterations, or
+    # diverge with no bracket to fall back to, end up NaN.
+    #
+    # Array constants in f hold per-lane coefficients, they broadcast
+    # against the starting points.
+    shapes = [
+        np.shape(node.value) for node in f.postorder()
+        if isinstance(node, Const) and not node.is_scalar
+    ]
+    per_lane = bool(shapes)
+    shape = np.broadcast_shapes(np.shape(x_0), *shapes)
+    d = f.d(V("x")).simplify().compile("x")
+    f = f.compile("x")
+
+    def at(compiled, values, lanes=None):
+        # Evaluates at ``values`` for the given lanes, all of them by
+        # default. Per-lane constants can't be subset, so such an f is
+        # evaluated at full width and the lanes picked from the result.
+        if lanes is None:
+            values = values.reshape(shape)
+        elif per_lane:
+            full = np.zeros(shape)
+            full.flat[lanes] = values
+            result = np.broadcast_to(compiled(full), shape).ravel()
+            return result[lanes].astype(float)
+        result = np.broadcast_to(compiled(values), values.shape)
+        return result.astype(float).ravel()
+
+    x = np.array(np.broadcast_to(np.asarray(x_0, dtype=float), shape)).ravel()
+    a = np.broadcast_to(np.nan if lo is None else lo, shape).ravel()
+    b = np.broadcast_to(np.nan if hi is None else hi, shape).ravel()
+    a, b = a.astype(float), b.astype(float)
+    with np.errstate(invalid="ignore"):
+        fa, fx = at(f, a), at(f, x)
+        invalid = ~(np.sign(fa) * np.sign(at(f, b)) < 0)
+    a[invalid] = b[invalid] = np.nan
+
+    roots = np.where(fx == 0, x, np.nan)
+    active = np.flatnonzero(fx != 0)
+    for _ in range(max_iter):
+        if not active.size:
+            break
+        xs, fs = x[active], fx[active]
+        las, lbs, fas = a[active], b[active], fa[active]
+        bracketed = ~np.isnan(las)
+        midpoint = (las + lbs) / 2
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            step = xs - fs / at(d, xs, active)
+            bisect = bracketed & ~(
+                (np.minimum(las, lbs) < step) & (step < np.maximum(las, lbs))
+            )
+            step[bisect] = midpoint[bisect]
+            f_step = at(f, step, active)
+            worse = bracketed & ~bisect & ~(np.abs(f_step) < np.abs(fs))
+            step[worse] = midpoint[worse]
+            f_step[worse] = at(f, step[worse], active[worse])
+
+        # Keeps a sign change of f between a and b, starting a bracket when
+        # the last two iterates straddle a root.
+        crossed = ~bracketed & (np.sign(fs) * np.sign(f_step) < 0)
+        las[crossed], fas[crossed] = xs[crossed], fs[crossed]
+        lbs[crossed] = step[crossed]
+        same_side = bracketed & (np.sign(f_step) == np.sign(fas))
+        las[same_side], fas[same_side] = step[same_side], f_step[same_side]
+        lbs[bracketed & ~same_side] = step[bracketed & ~same_side]
+        x[active], fx[active] = step, f_step
+        a[active], b[active], fa[active] = las, lbs, fas
+
+        # A bisection step may land where the iterate already was, so it
+        # has converged only once the bracket itself is small enough.
+        bisected = bisect | worse
+        converged = (f_step == 0) | np.where(
+            bisected,
+            np.abs(lbs - las) <= 2 * threshold,
+            np.abs(step - xs) <= threshold
+        )
+        roots[active[converged]] = step[converged]
+        failed = ~np.isfinite(step)
+        active = active[~converged & ~failed]
+
+    return roots.reshape(shape)
+
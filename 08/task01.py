@@ -1,3 +1,5 @@
+from array import array
+from collections import deque
 from itertools import chain, count, groupby, islice, repeat, tee
 
 
@@ -55,6 +57,62 @@ def padded(iterable, fillvalue, n):
 
 
 def sliding(iterable, n, step):
-    return zip(
-        *(islice(it, i, None, step) for i, it in enumerate(tee(iterable, n)))
-    )
+    if step < 1:
+        raise ValueError("step must be positive")
+    # zip over tee'd iterators does all the work in C and wins for small
+    # windows. Large strides are cheaper to skip with islice than to
+    # buffer in every tee'd iterator.
+    if step == 1 or n * step <= 64:
+        return zip(
+            *(islice(it, i, None, step)
+              for i, it in enumerate(tee(iterable, n)))
+        )
+    return iter_windows(iterable, n, step)
+
+
+def iter_windows(iterable, n, step):
+    it = iter(iterable)
+    window = deque(islice(it, n), maxlen=n)
+    if len(window) < n:
+        return
+    yield tuple(window)
+    if step >= n:
+        while True:
+            items = tuple(islice(it, step - n, step))
+            if len(items) < n:
+                return
+            yield items
+
+    while True:
+        items = tuple(islice(it, step))
+        if len(items) < step:
+            return
+        window.extend(items)
+        yield tuple(window)
+
+
+def sliding_view(iterable, n, step, typecode="d"):
+    # Yields read-only memoryviews instead of tuples. A view is only valid
+    # until the next one is requested, copy it to keep the window.
+    if step < 1:
+        raise ValueError("step must be positive")
+    if not n:
+        return
+    try:
+        view = memoryview(iterable).toreadonly()
+    except TypeError:
+        pass
+    else:
+        yield from (view[i:i + n] for i in range(0, len(view) - n + 1, step))
+        return
+
+    # Every item is written twice, to ``pos`` and ``pos + n``, so the last
+    # ``n`` items are always contiguous in ``buffer[pos:pos + n]``.
+    buffer = array(typecode, bytes(2 * n * array(typecode).itemsize))
+    view = memoryview(buffer).toreadonly()
+    pos = 0
+    for i, item in enumerate(iterable):
+        buffer[pos] = buffer[pos + n] = item
+        pos = (pos + 1) % n
+        if i >= n - 1 and (i - n + 1) % step == 0:
+            yield view[pos:pos + n]